@@ -1,11 +1,27 @@
-from typing import List, Tuple
-import os
+from typing import List
 from pathlib import Path
 from pydantic import BaseModel, Field
-from openai import OpenAI
-from dotenv import load_dotenv
+from openai.types.chat import ChatCompletion
 
 from utils.file_utils import create_run_directory, save_plan_to_json
+from utils.llm_cache import cached_llm_call
+from utils.openai_client import get_openai_client
+
+PLANNER_SYSTEM_PROMPT = """You are an expert research planner. Your task is to create a detailed research plan based on the user's query.
+The plan should include your reasoning about how to approach the research and a series of concrete steps.
+Each step should have a clear purpose and expected outcome.
+
+Format your response as a JSON object with the following structure:
+{
+    "reasoning": "your thought process about how to approach the research",
+    "steps": [
+        {
+            "instruction": "detailed instruction of what needs to be researched",
+            "expected_outcome": "what this step should yield"
+        },
+        ...
+    ]
+}"""
 
 class ResearchStep(BaseModel):
     """A single step in the research plan"""
@@ -21,39 +37,23 @@ class ResearchPlan(BaseModel):
 
 class PlannerAgent:
     def __init__(self):
-        load_dotenv()
-        
-        api_key = os.getenv("OPENAI_API_KEY")
-        if not api_key:
-            raise ValueError("OPENAI_API_KEY environment variable is required")
-            
-        self.client = OpenAI(api_key=api_key)
+        self.client = get_openai_client()
 
-    def create_initial_plan(self, query: str) -> Tuple[ResearchPlan, Path]:
-        """Create an initial research plan based on the user's query and save it"""
-        run_dir, run_id = create_run_directory()
-        
-        response = self.client.beta.chat.completions.parse(
+    @cached_llm_call(ChatCompletion)
+    async def _parse_completion(self, **request) -> ChatCompletion:
+        """Request a structured chat completion, served from the on-disk cache when possible"""
+        return await self.client.beta.chat.completions.parse(**request)
+
+    async def create_initial_plan(self, query: str) -> ResearchPlan:
+        """Create an initial research plan based on the user's query"""
+        response = await self._parse_completion(
             model="gpt-4o-mini",
             response_format=ResearchPlan,
+            temperature=0,
             messages=[
                 {
                     "role": "developer",
-                    "content": """You are an expert research planner. Your task is to create a detailed research plan based on the user's query.
-                    The plan should include your reasoning about how to approach the research and a series of concrete steps.
-                    Each step should have a clear purpose and expected outcome.
-                    
-                    Format your response as a JSON object with the following structure:
-                    {
-                        "reasoning": "your thought process about how to approach the research",
-                        "steps": [
-                            {
-                                "instruction": "detailed instruction of what needs to be researched",
-                                "expected_outcome": "what this step should yield"
-                            },
-                            ...
-                        ]
-                    }"""
+                    "content": PLANNER_SYSTEM_PROMPT
                 },
                 {
                     "role": "user",
@@ -62,13 +62,15 @@ class PlannerAgent:
             ]
         )
         
-        plan = response.choices[0].message.parsed
+        plan = ResearchPlan.model_validate_json(response.choices[0].message.content)
         
-        plan_dict = plan.model_dump()
-        plan_dict["query"] = query
-        plan_dict["run_id"] = run_id
-        final_plan = ResearchPlan(**plan_dict)
+        return plan.model_copy(update={"query": query})
+
+    def persist_plan(self, plan: ResearchPlan) -> Path:
+        """Create a run directory for an approved plan, assign its run ID and save it there"""
+        run_dir, run_id = create_run_directory()
         
-        save_plan_to_json(final_plan, run_dir)
+        plan.run_id = run_id
+        save_plan_to_json(plan, run_dir)
         
-        return final_plan, run_dir
+        return run_dir
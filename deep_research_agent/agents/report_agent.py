@@ -1,13 +1,32 @@
-import os
-import json
+import logging
 from pathlib import Path
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Callable
+from openai import LengthFinishReasonError
 from pydantic import BaseModel, Field
-from openai import OpenAI
-from dotenv import load_dotenv
 
 from agents.planner_agent import ResearchPlan
 from agents.search_agent import SearchResult
+from utils.llm_cache import get_cached, set_cached
+from utils.openai_client import get_openai_client
+
+logger = logging.getLogger(__name__)
+
+# The JSON of a structured report takes more tokens than the same report as Markdown
+REPORT_MAX_TOKENS = 16000
+REPORT_INCOMPLETE_NOTE = "> **Note:** This report is incomplete because it reached the maximum response length.\n"
+
+REPORT_SYSTEM_PROMPT = """You are an expert research report writer. Generate a ResearchReport from the research data.
+Be concise but thorough. Include important insights from the research and cite sources where appropriate."""
+
+class ReportFinding(BaseModel):
+    """A key finding of the research"""
+    title: str = Field(..., description="Short title of the finding")
+    details: str = Field(..., description="Explanation of the finding and the evidence for it")
+
+class ReportReference(BaseModel):
+    """A source used in the research"""
+    title: str = Field(..., description="Title of the source")
+    url: str = Field(..., description="URL of the source")
 
 class ResearchReport(BaseModel):
     """Comprehensive research report based on all collected data"""
@@ -15,21 +34,15 @@ class ResearchReport(BaseModel):
     executive_summary: str = Field(..., description="Brief executive summary of the research findings")
     introduction: str = Field(..., description="Introduction to the research topic")
     methodology: str = Field(..., description="Methodology used in the research")
-    findings: List[Dict[str, str]] = Field(..., description="Key findings of the research")
+    findings: List[ReportFinding] = Field(..., description="Key findings of the research")
     conclusions: str = Field(..., description="Conclusions drawn from the research")
-    references: List[Dict[str, str]] = Field(default_factory=list, description="References used in the research")
+    references: List[ReportReference] = Field(default_factory=list, description="References used in the research")
 
 class ReportAgent:
     """Agent responsible for generating a comprehensive research report"""
     
     def __init__(self):
-        load_dotenv()
-        
-        api_key = os.getenv("OPENAI_API_KEY")
-        if not api_key:
-            raise ValueError("OPENAI_API_KEY environment variable is required")
-            
-        self.client = OpenAI(api_key=api_key)
+        self.client = get_openai_client()
     
     def _collect_all_data(self, plan: ResearchPlan, search_results: List[SearchResult]) -> Dict[str, Any]:
         """Collect all data from the research process"""
@@ -40,6 +53,8 @@ class ReportAgent:
             "citations": []
         }
         
+        seen_urls = set()
+        
         for result in search_results:
             step_data = {
                 "step_number": result.step_number,
@@ -50,80 +65,140 @@ class ReportAgent:
             all_data["steps"].append(step_data)
             
             for citation in result.citations:
-                if citation not in all_data["citations"] and "url" in citation and citation["url"]:
+                url = citation.get("url")
+                if url and url not in seen_urls:
+                    seen_urls.add(url)
                     all_data["citations"].append(citation)
         
         return all_data
     
-    def generate_report(self, plan: ResearchPlan, search_results: List[SearchResult]) -> str:
-        """Generate a comprehensive research report based on all collected data"""
-        print("Generating research report...")
+    async def generate_report(self, plan: ResearchPlan, search_results: List[SearchResult], on_token: Optional[Callable[[str], None]] = None) -> str:
+        """Generate a comprehensive research report based on all collected data, passing each streamed chunk to on_token"""
+        logger.info("Generating research report...")
         
         all_data = self._collect_all_data(plan, search_results)
         
-        context = f"""
-        RESEARCH QUERY: {all_data['query']}
-        
-        RESEARCH REASONING: {all_data['reasoning']}
-        
-        RESEARCH STEPS AND FINDINGS:
-        """
+        context_parts = [
+            f"RESEARCH QUERY: {all_data['query']}\n\n",
+            f"RESEARCH REASONING: {all_data['reasoning']}\n\n",
+            "RESEARCH STEPS AND FINDINGS:\n"
+        ]
         
         for step in all_data["steps"]:
-            context += f"""
-            STEP {step['step_number']}: {step['instruction']}
-            SEARCH QUERY: {step['search_query']}
-            SUMMARY: {step['summary']}
-            ---
-            """
+            context_parts.append(
+                f"\nSTEP {step['step_number']}: {step['instruction']}\n"
+                f"SEARCH QUERY: {step['search_query']}\n"
+                f"SUMMARY: {step['summary']}\n"
+                "---\n"
+            )
         
         if all_data["citations"]:
-            context += "\nCITATIONS:\n"
+            context_parts.append("\nCITATIONS:\n")
             for citation in all_data["citations"]:
-                context += f"- {citation.get('title', 'No title')}: {citation.get('url', 'No URL')}\n"
+                context_parts.append(f"- {citation.get('title', 'No title')}: {citation.get('url', 'No URL')}\n")
         
-        response = self.client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
+        context = "".join(context_parts)
+        
+        request = {
+            "model": "gpt-4o-mini",
+            "response_format": ResearchReport,
+            "temperature": 0,
+            "messages": [
                 {
                     "role": "system",
-                    "content": """You are an expert research report writer. Your task is to create a comprehensive research report based on the data collected.
-                    The report should include:
-                    1. Title
-                    2. Executive Summary
-                    3. Introduction
-                    4. Methodology
-                    5. Findings
-                    6. Conclusions
-                    7. References
-                    
-                    Format your response in Markdown. Use proper headings, bullet points, and formatting to make the report readable and professional.
-                    Be concise but thorough. Include important insights from the research and cite sources where appropriate.
-                    """
+                    "content": REPORT_SYSTEM_PROMPT
                 },
                 {
                     "role": "user",
                     "content": context
                 }
             ],
-            max_tokens=4000
-        )
+            "max_tokens": REPORT_MAX_TOKENS
+        }
+        
+        cached_report = get_cached(request)
+        if cached_report is not None:
+            report = self._render_markdown(ResearchReport.model_validate(cached_report))
+            if on_token:
+                on_token(report)
+            return report
+        
+        report_parts = []
         
-        report = response.choices[0].message.content
+        try:
+            async with self.client.beta.chat.completions.stream(**request) as stream:
+                async for event in stream:
+                    if event.type != "content.delta" or not isinstance(event.parsed, dict):
+                        continue
+                    
+                    # A section is complete once the model has moved on to the next field
+                    complete_sections = list(event.parsed.items())[len(report_parts):-1]
+                    for name, value in complete_sections:
+                        section = self._render_section(name, value)
+                        report_parts.append(section)
+                        if on_token:
+                            on_token(section)
+                
+                completion = await stream.get_final_completion()
+        except LengthFinishReasonError:
+            # Keep the sections completed so far rather than losing the whole report, but don't cache them
+            logger.warning("The research report reached the limit of %d tokens and is incomplete", REPORT_MAX_TOKENS)
+            if on_token:
+                on_token(REPORT_INCOMPLETE_NOTE)
+            return "".join(report_parts) + REPORT_INCOMPLETE_NOTE
+        
+        message = completion.choices[0].message
+        if message.parsed is None:
+            raise ValueError(f"The model did not return a research report: {message.refusal}")
+        
+        set_cached(request, message.parsed)
+        
+        report = self._render_markdown(message.parsed)
+        streamed = "".join(report_parts)
+        if on_token and report.startswith(streamed):
+            on_token(report[len(streamed):])
+        elif on_token:
+            logger.warning("Streamed report sections differ from the final report")
         return report
     
-    def save_report(self, report: str, run_dir: Path) -> Path:
-        """Save the research report to a file"""
+    def _render_section(self, name: str, value: Any) -> str:
+        """Render a single field of a research report as Markdown"""
+        if name == "title":
+            return f"# {value}\n\n"
+        
+        heading = name.replace("_", " ").title()
+        
+        if name == "findings":
+            findings = "".join(f"### {finding['title']}\n\n{finding['details']}\n\n" for finding in value)
+            return f"## {heading}\n\n{findings}"
+        
+        if name == "references":
+            references = "".join(f"- [{reference['title']}]({reference['url']})\n" for reference in value)
+            return f"## {heading}\n\n{references or 'No references.'}\n"
+        
+        return f"## {heading}\n\n{value}\n\n"
+    
+    def _render_markdown(self, report: ResearchReport) -> str:
+        """Render a research report as Markdown, one section per field"""
+        return "".join(self._render_section(name, value) for name, value in report.model_dump().items())
+    
+    async def generate_and_save_report(self, plan: ResearchPlan, search_results: List[SearchResult], run_dir: Path, on_token: Optional[Callable[[str], None]] = None) -> Path:
+        """Generate a comprehensive research report, writing it to disk as it streams in"""
         report_path = run_dir / "research_report.md"
         
         with open(report_path, "w", encoding="utf-8") as f:
+            def write_token(token: str) -> None:
+                f.write(token)
+                f.flush()
+                if on_token:
+                    on_token(token)
+            
+            report = await self.generate_report(plan, search_results, on_token=write_token)
+            
+            # The streamed sections are only a preview, the saved report is always the final one
+            f.seek(0)
             f.write(report)
+            f.truncate()
         
-        print(f"Research report saved to: {report_path}")
-        return report_path
-    
-    def generate_and_save_report(self, plan: ResearchPlan, search_results: List[SearchResult], run_dir: Path) -> Path:
-        """Generate and save a comprehensive research report"""
-        report = self.generate_report(plan, search_results)
-        report_path = self.save_report(report, run_dir)
+        logger.info("Research report saved to: %s", report_path)
         return report_path
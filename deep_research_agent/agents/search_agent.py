@@ -1,13 +1,48 @@
-import os
+import asyncio
+import gzip
+import hashlib
 import json
+import logging
+import time
+from itertools import islice
 from pathlib import Path
-from typing import List, Dict, Any, Optional, Union
+from typing import List, Dict, Any, Callable, Iterator, Optional, Union
 from pydantic import BaseModel, Field
-from openai import OpenAI
-from dotenv import load_dotenv
+from openai.types import Batch
+from openai.types.chat import ChatCompletion
+from openai.types.responses import Response
 
 from agents.planner_agent import ResearchStep, ResearchPlan
 from utils.file_utils import get_data_dir
+from utils.llm_cache import cached_llm_call, get_cached, is_cache_enabled, set_cached
+from utils.semantic_cache import SemanticCache
+from utils.openai_client import get_openai_client
+
+logger = logging.getLogger(__name__)
+
+MAX_SEARCH_WORKERS = 8
+SEARCH_CACHE_TTL_SECONDS = 7 * 24 * 60 * 60
+
+SEARCH_RESULTS_DIRNAME = "search_results"
+RESULTS_FILENAME = "results.jsonl"
+SUMMARIES_FILENAME = "summaries.txt"
+RESEARCH_SUMMARY_FILENAME = "research_summary.txt"
+MAX_CITATIONS_TEXT = 50
+
+BATCH_TIMEOUT_SECONDS = 30 * 60
+BATCH_POLL_INITIAL_DELAY = 5
+BATCH_POLL_MAX_DELAY = 60
+BATCH_FINAL_STATUSES = ("completed", "failed", "expired", "cancelling", "cancelled")
+
+SEARCH_QUERY_SYSTEM_PROMPT = """You are an expert at crafting effective search queries.
+Your task is to convert a research instruction into a concise, specific search query
+that will yield the most relevant information.
+Format your response as a single search query with no additional text or explanation."""
+
+SEARCH_QUERIES_SYSTEM_PROMPT = """You are an expert at crafting effective search queries.
+Your task is to convert each numbered research instruction into a concise, specific search query
+that will yield the most relevant information.
+Return exactly one search query per instruction, in the same order as the instructions."""
 
 class SearchResult(BaseModel):
     """Result of a web search for a research step"""
@@ -15,46 +50,244 @@ class SearchResult(BaseModel):
     step_instruction: str = Field(..., description="The instruction that was researched")
     search_query: str = Field(..., description="The search query used")
     summary: str = Field(..., description="Summary of the search results")
-    citations: List[Dict[str, str]] = Field(default_factory=list, description="Citations from the search")
+    citations: List[Dict[str, Any]] = Field(default_factory=list, description="Citations from the search")
     raw_response: Union[Dict[str, Any], List[Any]] = Field(default_factory=dict, description="Raw response from the API")
 
+class SearchQueries(BaseModel):
+    """Search queries generated for a list of research steps"""
+    queries: List[str] = Field(..., description="One search query per research step, in the same order as the steps")
+
+class ResearchSummaryWriter:
+    """Writes the combined research summary incrementally, keeping step order when steps finish out of order"""
+    
+    def __init__(self, plan: ResearchPlan, path: Path):
+        self.path = path
+        self._pending: Dict[int, SearchResult] = {}
+        self._next_step = 1
+        
+        self._file = open(path, "w", encoding="utf-8", buffering=1 << 16)
+        self._file.write(self.format_header(plan))
+    
+    @staticmethod
+    def format_header(plan: ResearchPlan) -> str:
+        """Format the opening of the summary with the query and the planner's reasoning"""
+        return f"RESEARCH SUMMARY FOR: {plan.query}\n\nREASONING: {plan.reasoning}\n\n"
+    
+    @staticmethod
+    def format_result(result: SearchResult) -> str:
+        """Format the summary section of a single step"""
+        return (
+            f"STEP {result.step_number}: {result.step_instruction}\n\n"
+            f"SUMMARY:\n{result.summary}\n\n"
+            "---\n\n"
+        )
+    
+    def _write_result(self, result: SearchResult) -> None:
+        """Write the summary section of a single step"""
+        self._file.write(self.format_result(result))
+    
+    def add(self, result: SearchResult) -> None:
+        """Add a step result, writing it and any held back results as soon as all earlier steps are written"""
+        self._pending[result.step_number] = result
+        
+        while self._next_step in self._pending:
+            self._write_result(self._pending.pop(self._next_step))
+            self._next_step += 1
+    
+    def close(self) -> None:
+        """Write the results still held back because an earlier step is missing and close the file"""
+        for step_number in sorted(self._pending):
+            self._write_result(self._pending[step_number])
+        self._pending.clear()
+        
+        self._file.close()
+    
+    def __enter__(self) -> "ResearchSummaryWriter":
+        return self
+    
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+class StepResultWriter:
+    """Appends the result of each research step to a single JSONL file and its readable summary to a single text file"""
+    
+    def __init__(self, search_dir: Path, keep_raw: bool = False):
+        self.search_dir = search_dir
+        self.keep_raw = keep_raw
+        self._lock = asyncio.Lock()
+        
+        self._results_file = open(search_dir / RESULTS_FILENAME, "a", encoding="utf-8", buffering=1 << 16)
+        self._summaries_file = open(search_dir / SUMMARIES_FILENAME, "a", encoding="utf-8", buffering=1 << 16)
+    
+    def add(self, result: SearchResult) -> None:
+        """Append the result and summary of a single step, plus its compressed raw response if keep_raw is set"""
+        i = result.step_number
+        
+        # The raw response can be megabytes and its summary and citations are already extracted.
+        # Flushed per step so the log holds every finished step if the run dies midway
+        self._results_file.write(result.model_dump_json(exclude={"raw_response"}) + "\n")
+        self._results_file.flush()
+        
+        if self.keep_raw:
+            raw_path = self.search_dir / f"step_{i}_raw.json.gz"
+            raw_path.write_bytes(gzip.compress(json.dumps(result.raw_response, ensure_ascii=False).encode("utf-8")))
+        
+        summary_parts = [
+            f"RESEARCH STEP {i}: {result.step_instruction}\n\n",
+            f"SEARCH QUERY: {result.search_query}\n\n",
+            f"SUMMARY:\n{result.summary}\n\n",
+            "CITATIONS:\n"
+        ]
+        # The full list is kept in the JSONL log, the readable summary only lists the first ones
+        summary_parts.extend(f"- {citation.get('title', 'No title')}: {citation.get('url', 'No URL')}\n" for citation in islice(result.citations, MAX_CITATIONS_TEXT))
+        if len(result.citations) > MAX_CITATIONS_TEXT:
+            summary_parts.append(f"- ... and {len(result.citations) - MAX_CITATIONS_TEXT} more in {RESULTS_FILENAME}\n")
+        summary_parts.append("\n---\n\n")
+        
+        self._summaries_file.write("".join(summary_parts))
+    
+    async def write(self, result: SearchResult) -> None:
+        """Add a step result from a worker thread, so the event loop keeps serving the other steps meanwhile"""
+        async with self._lock:
+            await asyncio.to_thread(self.add, result)
+    
+    def close(self) -> None:
+        """Flush and close both files"""
+        self._results_file.close()
+        self._summaries_file.close()
+    
+    def __enter__(self) -> "StepResultWriter":
+        return self
+    
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
 class SearchAgent:
     """Agent responsible for searching the web for information related to research steps"""
     
     def __init__(self):
-        load_dotenv()
-        
-        api_key = os.getenv("OPENAI_API_KEY")
-        if not api_key:
-            raise ValueError("OPENAI_API_KEY environment variable is required")
+        self.client = get_openai_client()
+        self.query_cache = SemanticCache(self.client)
+    
+    @cached_llm_call(ChatCompletion)
+    async def _create_completion(self, **request) -> ChatCompletion:
+        """Request a chat completion, served from the on-disk cache when possible"""
+        return await self.client.chat.completions.create(**request)
+    
+    @cached_llm_call(ChatCompletion)
+    async def _parse_completion(self, **request) -> ChatCompletion:
+        """Request a structured chat completion, served from the on-disk cache when possible"""
+        return await self.client.beta.chat.completions.parse(**request)
+    
+    def _search_cache_key(self, query: str, tools: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Build the search cache key from the normalized query and the search configuration"""
+        return {
+            "model": "gpt-4o-mini",
+            "tools": tools,
+            "search_query": " ".join(query.lower().split())
+        }
             
-        self.client = OpenAI(api_key=api_key)
+    def _describe_step(self, step: ResearchStep) -> str:
+        """Describe a research step for search query generation"""
+        return f"Research instruction: {step.instruction}\nExpected outcome: {step.expected_outcome}"
             
-    def generate_search_query(self, step: ResearchStep) -> str:
-        """Generate an effective search query based on the research step"""
-        response = self.client.chat.completions.create(
+    async def _request_search_query(self, step_text: str) -> str:
+        """Ask the model for the search query of a single described research step"""
+        response = await self._create_completion(
             model="gpt-4o-mini",
+            temperature=0,
             messages=[
                 {
                     "role": "system",
-                    "content": """You are an expert at crafting effective search queries. 
-                    Your task is to convert a research instruction into a concise, specific search query 
-                    that will yield the most relevant information. 
-                    Format your response as a single search query with no additional text or explanation."""
+                    "content": SEARCH_QUERY_SYSTEM_PROMPT
                 },
                 {
                     "role": "user",
-                    "content": f"Research instruction: {step.instruction}\nExpected outcome: {step.expected_outcome}\n\nCreate a concise search query:"
+                    "content": f"{step_text}\n\nCreate a concise search query:"
                 }
             ],
             max_tokens=50
         )
         
-        search_query = response.choices[0].message.content.strip()
+        return response.choices[0].message.content.strip()
+        
+    async def generate_search_query(self, step: ResearchStep) -> str:
+        """Generate an effective search query based on the research step"""
+        step_text = self._describe_step(step)
+        
+        cached_query = await self.query_cache.get(step_text)
+        if cached_query:
+            return cached_query
+        
+        search_query = await self._request_search_query(step_text)
+        await self.query_cache.add(step_text, search_query)
         return search_query
         
-    def search_web(self, query: str, user_location: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
-        """Execute a web search using OpenAI's web search API"""
+    async def generate_search_queries(self, steps: List[ResearchStep]) -> List[Optional[str]]:
+        """Generate search queries for several research steps with a single request, None for steps whose query could not be generated"""
+        if not steps:
+            return []
+        
+        step_texts = [self._describe_step(step) for step in steps]
+        
+        # All steps are embedded with one request, and the embeddings are reused to cache the new queries
+        embeddings = None
+        search_queries = [None] * len(steps)
+        if is_cache_enabled():
+            embeddings = await self.query_cache.embed(step_texts)
+            search_queries = await self.query_cache.lookup(embeddings)
+        
+        missing = [i for i, search_query in enumerate(search_queries) if not search_query]
+        if not missing:
+            return search_queries
+        
+        try:
+            response = await self._parse_completion(
+                model="gpt-4o-mini",
+                response_format=SearchQueries,
+                temperature=0,
+                messages=[
+                    {
+                        "role": "system",
+                        "content": SEARCH_QUERIES_SYSTEM_PROMPT
+                    },
+                    {
+                        "role": "user",
+                        "content": "\n\n".join(f"{n}. {step_texts[i]}" for n, i in enumerate(missing, 1))
+                    }
+                ]
+            )
+            
+            # A refusal or a truncated answer fails validation here as well
+            generated = SearchQueries.model_validate_json(response.choices[0].message.content).queries
+        except Exception as e:
+            logger.warning("Error generating the search queries in one request, falling back to one request per step: %s", e)
+            generated = None
+        
+        if generated is not None and len(generated) == len(missing):
+            generated = [search_query.strip() for search_query in generated]
+        else:
+            if generated is not None:
+                # The queries can't be matched to their steps, so each step gets its own request instead
+                logger.warning("Expected %d search queries but got %d, falling back to one request per step", len(missing), len(generated))
+            generated = await asyncio.gather(*[self._request_search_query(step_texts[i]) for i in missing], return_exceptions=True)
+        
+        # A step whose query still failed is left as None and generates its query when it runs
+        generated_steps = []
+        for i, search_query in zip(missing, generated):
+            if isinstance(search_query, Exception):
+                logger.warning("Error generating a search query: %s", search_query)
+                continue
+            search_queries[i] = search_query
+            generated_steps.append(i)
+        
+        if embeddings is not None and generated_steps:
+            await self.query_cache.store([embeddings[i] for i in generated_steps], [search_queries[i] for i in generated_steps])
+        
+        return search_queries
+        
+    def _search_tools(self, user_location: Optional[Dict[str, str]] = None) -> List[Dict[str, Any]]:
+        """Build the web search tool configuration"""
         tools = [{
             "type": "web_search_preview",
             "search_context_size": "low"
@@ -63,94 +296,114 @@ class SearchAgent:
         if user_location:
             tools[0]["user_location"] = user_location
         
-        print(f"Searching for: {query}")
-        print(f"Using tools: {tools}")
+        return tools
+        
+    def _format_response(self, response: Any) -> Dict[str, Any]:
+        """Convert a web search response into a plain dictionary of its output items"""
+        try:
+            search_result = {
+                "model": getattr(response, 'model', 'unknown'),
+                "created_at": getattr(response, 'created_at', None),
+                "output_items": []
+            }
+            
+            if hasattr(response, 'output'):
+                for item in response.output:
+                    if hasattr(item, 'model_dump'):
+                        item_dict = item.model_dump()
+                        search_result["output_items"].append(item_dict)
+                    elif isinstance(item, dict):
+                        search_result["output_items"].append(item)
+                    else:
+                        search_result["output_items"].append({"type": str(type(item)), "content": str(item)})
+            elif hasattr(response, 'model_dump'):
+                search_result = response.model_dump()
+            else:
+                search_result["text"] = str(response)
+            
+            return search_result
+        
+        except Exception as e:
+            logger.warning("Error parsing response: %s", e)
+            return {
+                "error": "Could not parse response", 
+                "error_message": str(e),
+                "response_str": str(response)
+            }
+        
+    async def search_web(self, query: str, user_location: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+        """Execute a web search using OpenAI's web search API"""
+        tools = self._search_tools(user_location)
+        
+        logger.debug("Searching for: %s", query)
+        logger.debug("Using tools: %s", tools)
+        
+        cache_key = self._search_cache_key(query, tools)
+        cached_result = get_cached(cache_key)
+        if cached_result is not None:
+            logger.debug("Search result served from cache")
+            return cached_result
             
         try:
-            print("Calling OpenAI API...")
-            response = self.client.responses.create(
+            logger.debug("Calling OpenAI API...")
+            response = await self.client.responses.create(
                 model="gpt-4o-mini",
                 tools=tools,
                 input=query
             )
-            print("Response received from OpenAI API")
+            logger.debug("Response received from OpenAI API")
             
-            print(f"Response type: {type(response)}")
-            if hasattr(response, 'model_dump'):
-                try:
-                    response_dict = response.model_dump()
-                    print(f"Response has model_dump method: {list(response_dict.keys())}")
-                except Exception as e:
-                    print(f"Failed to use model_dump: {e}")
-
-            try:
-                print(f"Response dir: {dir(response)[:10]}...")
-                print(f"Response has output attribute: {hasattr(response, 'output')}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Response type: %s", type(response))
+                logger.debug("Response dir: %s...", dir(response)[:10])
                 if hasattr(response, 'output'):
-                    print(f"Output type: {type(response.output)}")
-                    print(f"Output length: {len(response.output) if hasattr(response.output, '__len__') else 'N/A'}")
-            except Exception as e:
-                print(f"Error inspecting response attributes: {e}")
+                    logger.debug("Output length: %s", len(response.output) if hasattr(response.output, '__len__') else 'N/A')
             
-            try:
-                search_result = {
-                    "model": getattr(response, 'model', 'unknown'),
-                    "created_at": getattr(response, 'created_at', None),
-                    "output_items": []
-                }
-                
-                if hasattr(response, 'output'):
-                    for item in response.output:
-                        if hasattr(item, 'model_dump'):
-                            item_dict = item.model_dump()
-                            search_result["output_items"].append(item_dict)
-                        elif isinstance(item, dict):
-                            search_result["output_items"].append(item)
-                        else:
-                            search_result["output_items"].append({"type": str(type(item)), "content": str(item)})
-                elif hasattr(response, 'model_dump'):
-                    search_result = response.model_dump()
-                else:
-                    search_result["text"] = str(response)
-                
-                return search_result
+            search_result = self._format_response(response)
+            if "error" not in search_result:
+                set_cached(cache_key, search_result, ttl=SEARCH_CACHE_TTL_SECONDS)
             
-            except Exception as e:
-                print(f"Error parsing response: {e}")
-                return {
-                    "error": "Could not parse response", 
-                    "error_message": str(e),
-                    "response_str": str(response)
-                }
+            return search_result
                 
         except Exception as e:
-            print(f"Error searching web: {e}")
+            logger.warning("Error searching web for %r: %s", query, e, exc_info=True)
             return {"error": str(e)}
             
-    def extract_citations(self, response: Dict[str, Any]) -> List[Dict[str, str]]:
-        """Extract citations from the search response"""
+    def _iter_output_texts(self, response: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        """Yield the output_text contents of the message items in a search response"""
+        for item in response.get("output_items", []):
+            if item.get("type") != "message":
+                continue
+            
+            for content in item.get("content", []):
+                if content.get("type") == "output_text":
+                    yield content
+        
+    def extract_citations(self, response: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Extract the unique citations from the search response"""
         citations = []
+        seen_urls = set()
         
         try:
-            output_items = response.get("output_items", [])
-            
-            for item in output_items:
-                if item.get("type") == "message":
-                    contents = item.get("content", [])
-                    for content in contents:
-                        if content.get("type") == "output_text":
-                            annotations = content.get("annotations", [])
-                            for annotation in annotations:
-                                if annotation.get("type") == "url_citation":
-                                    citation = {
-                                        "url": annotation.get("url", ""),
-                                        "title": annotation.get("title", ""),
-                                        "start_index": annotation.get("start_index", 0),
-                                        "end_index": annotation.get("end_index", 0)
-                                    }
-                                    citations.append(citation)
+            for content in self._iter_output_texts(response):
+                for annotation in content.get("annotations", []):
+                    if annotation.get("type") != "url_citation":
+                        continue
+                    
+                    url = annotation.get("url", "")
+                    if url in seen_urls:
+                        continue
+                    seen_urls.add(url)
+                    
+                    citation = {
+                        "url": url,
+                        "title": annotation.get("title", ""),
+                        "start_index": annotation.get("start_index", 0),
+                        "end_index": annotation.get("end_index", 0)
+                    }
+                    citations.append(citation)
         except Exception as e:
-            print(f"Error extracting citations: {e}")
+            logger.warning("Error extracting citations: %s", e)
             
         return citations
         
@@ -159,18 +412,9 @@ class SearchAgent:
         summary = ""
         
         try:
-            if "output_items" in response:
-                output_items = response.get("output_items", [])
-                
-                for item in output_items:
-                    if item.get("type") == "message":
-                        contents = item.get("content", [])
-                        for content in contents:
-                            if content.get("type") == "output_text":
-                                text = content.get("text", "")
-                                if text:
-                                    summary = text
-                                    return summary
+            summary = next((content["text"] for content in self._iter_output_texts(response) if content.get("text")), "")
+            if summary:
+                return summary
             
             if not summary and "output_text" in response:
                 return response["output_text"]
@@ -188,18 +432,13 @@ class SearchAgent:
                     summary += "Please check the raw response for complete information."
         
         except Exception as e:
-            print(f"Error extracting summary: {e}")
+            logger.warning("Error extracting summary: %s", e)
             summary = f"Error extracting summary: {e}"
             
         return summary
         
-    def execute_search_step(self, step: ResearchStep, step_number: int) -> SearchResult:
-        """Execute a single research step by searching the web"""
-        search_query = self.generate_search_query(step)
-        print(f"Generated search query: {search_query}")
-        
-        search_response = self.search_web(search_query)
-        
+    def _build_search_result(self, step: ResearchStep, step_number: int, search_query: str, search_response: Dict[str, Any]) -> SearchResult:
+        """Build the result of a research step from its web search response"""
         summary = self.extract_summary(search_response)
         citations = self.extract_citations(search_response)
         
@@ -217,40 +456,206 @@ class SearchAgent:
         
         return search_result
         
-    def execute_research_plan(self, plan: ResearchPlan, run_dir: Path) -> List[SearchResult]:
-        """Execute the entire research plan by processing each step"""
-        search_results = []
+    async def execute_search_step(self, step: ResearchStep, step_number: int, search_query: Optional[str] = None) -> SearchResult:
+        """Execute a single research step by searching the web, generating a search query unless one is given"""
+        if search_query is None:
+            search_query = await self.generate_search_query(step)
+            logger.debug("Generated search query: %s", search_query)
+        
+        search_response = await self.search_web(search_query)
+        
+        return self._build_search_result(step, step_number, search_query, search_response)
+        
+    def find_duplicate_steps(self, steps: List[ResearchStep]) -> Dict[int, int]:
+        """Map the number of each step that repeats an earlier step's instruction to the number of that earlier step"""
+        first_steps = {}
+        duplicates = {}
+        
+        for i, step in enumerate(steps, 1):
+            step_hash = hashlib.sha256(step.instruction.lower().strip().encode("utf-8")).hexdigest()
+            if step_hash in first_steps:
+                duplicates[i] = first_steps[step_hash]
+                logger.info("Research step %d deduplicated to step %d", i, duplicates[i])
+            else:
+                first_steps[step_hash] = i
+        
+        return duplicates
+        
+    def format_research_summary(self, plan: ResearchPlan, search_results: List[SearchResult]) -> str:
+        """Format the combined summary of all research steps, the same text that is saved as research_summary.txt"""
+        summary_parts = [ResearchSummaryWriter.format_header(plan)]
+        summary_parts.extend(ResearchSummaryWriter.format_result(result) for result in sorted(search_results, key=lambda result: result.step_number))
+        return "".join(summary_parts)
+        
+    def copy_step_result(self, result: SearchResult, step: ResearchStep, step_number: int) -> SearchResult:
+        """Reuse the result of a step for a duplicate of it, without searching again"""
+        return result.model_copy(update={"step_number": step_number, "step_instruction": step.instruction})
+        
+    async def _generate_step_queries(self, plan: ResearchPlan, step_numbers: List[int]) -> Dict[int, Optional[str]]:
+        """Generate the search queries of the given steps, keyed by step number, None where generation failed"""
+        search_queries = await self.generate_search_queries([plan.steps[i - 1] for i in step_numbers])
+        return dict(zip(step_numbers, search_queries))
+        
+    async def _execute_search_steps(self, plan: ResearchPlan, search_queries: Dict[int, Optional[str]], step_numbers: List[int], step_writer: StepResultWriter, summary_writer: ResearchSummaryWriter, on_result: Optional[Callable[[SearchResult], None]] = None, max_concurrency: int = MAX_SEARCH_WORKERS) -> List[SearchResult]:
+        """Execute the given steps of a research plan, at most max_concurrency at a time, saving each result and passing it to on_result as it arrives, and leaving out steps that fail"""
+        total_steps = len(plan.steps)
+        semaphore = asyncio.Semaphore(max_concurrency)
         
-        search_dir = run_dir / "search_results"
+        async def run_step(i: int) -> Optional[SearchResult]:
+            step = plan.steps[i - 1]
+            
+            # A failed step is skipped so the other steps still finish and get saved
+            try:
+                async with semaphore:
+                    logger.debug("Executing research step %d/%d: %s...", i, total_steps, step.instruction[:50])
+                    result = await self.execute_search_step(step, i, search_queries[i])
+            except Exception as e:
+                logger.warning("Error in research step %d, continuing with the other steps: %s", i, e)
+                return None
+            
+            logger.debug("Completed research step %d/%d", i, total_steps)
+            
+            # Written while the remaining steps are still searching
+            await step_writer.write(result)
+            summary_writer.add(result)
+            if on_result:
+                on_result(result)
+            return result
+        
+        search_results = await asyncio.gather(*[run_step(i) for i in step_numbers])
+        return [result for result in search_results if result is not None]
+        
+    def _add_duplicate_results(self, plan: ResearchPlan, duplicates: Dict[int, int], search_results: List[SearchResult], step_writer: StepResultWriter, summary_writer: ResearchSummaryWriter, on_result: Optional[Callable[[SearchResult], None]] = None) -> List[SearchResult]:
+        """Add a copy of the original step's result for each duplicate step and return all results in step order"""
+        results_by_step = {result.step_number: result for result in search_results}
+        
+        for i, original in duplicates.items():
+            if original not in results_by_step:
+                continue
+            
+            result = self.copy_step_result(results_by_step[original], plan.steps[i - 1], i)
+            results_by_step[i] = result
+            step_writer.add(result)
+            summary_writer.add(result)
+            if on_result:
+                on_result(result)
+        
+        return [results_by_step[i] for i in sorted(results_by_step)]
+        
+    async def execute_research_plan(self, plan: ResearchPlan, run_dir: Path, keep_raw: bool = False, on_result: Optional[Callable[[SearchResult], None]] = None, max_concurrency: int = MAX_SEARCH_WORKERS) -> List[SearchResult]:
+        """Execute the entire research plan, searching up to max_concurrency steps at a time and passing each result to on_result as it completes"""
+        search_dir = run_dir / SEARCH_RESULTS_DIRNAME
         search_dir.mkdir(exist_ok=True)
         
-        for i, step in enumerate(plan.steps, 1):
-            print(f"Executing research step {i}/{len(plan.steps)}: {step.instruction[:50]}...")
+        duplicates = self.find_duplicate_steps(plan.steps)
+        step_numbers = [i for i in range(1, len(plan.steps) + 1) if i not in duplicates]
+        search_queries = await self._generate_step_queries(plan, step_numbers)
+        
+        with StepResultWriter(search_dir, keep_raw) as step_writer, ResearchSummaryWriter(plan, run_dir / RESEARCH_SUMMARY_FILENAME) as summary_writer:
+            search_results = await self._execute_search_steps(plan, search_queries, step_numbers, step_writer, summary_writer, on_result, max_concurrency)
+            search_results = self._add_duplicate_results(plan, duplicates, search_results, step_writer, summary_writer, on_result)
+        
+        return search_results
+        
+    async def _wait_for_batch(self, batch: Batch, timeout: float) -> Batch:
+        """Poll a batch with exponential backoff until it finishes or the timeout expires"""
+        deadline = time.monotonic() + timeout
+        delay = BATCH_POLL_INITIAL_DELAY
+        
+        while batch.status not in BATCH_FINAL_STATUSES:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
             
-            result = self.execute_search_step(step, i)
-            search_results.append(result)
+            await asyncio.sleep(min(delay, remaining))
+            delay = min(delay * 2, BATCH_POLL_MAX_DELAY)
             
-            result_path = search_dir / f"step_{i}_result.json"
-            with open(result_path, "w", encoding="utf-8") as f:
-                json.dump(result.model_dump(), f, indent=2, ensure_ascii=False)
+            batch = await self.client.batches.retrieve(batch.id)
+            print(f"Batch {batch.id} status: {batch.status}")
+        
+        return batch
+        
+    async def execute_research_plan_batch(self, plan: ResearchPlan, run_dir: Path, timeout: float = BATCH_TIMEOUT_SECONDS, keep_raw: bool = False) -> List[SearchResult]:
+        """Execute the research plan through the OpenAI Batch API, searching directly for steps the batch doesn't complete in time"""
+        search_dir = run_dir / SEARCH_RESULTS_DIRNAME
+        search_dir.mkdir(exist_ok=True)
+        
+        duplicates = self.find_duplicate_steps(plan.steps)
+        step_numbers = [i for i in range(1, len(plan.steps) + 1) if i not in duplicates]
+        search_queries = await self._generate_step_queries(plan, step_numbers)
+        
+        # Steps without a query generate it when they are searched directly
+        requests = []
+        for i, search_query in search_queries.items():
+            if search_query is None:
+                continue
+            
+            requests.append(json.dumps({
+                "custom_id": f"step_{i}",
+                "method": "POST",
+                "url": "/v1/responses",
+                "body": {
+                    "model": "gpt-4o-mini",
+                    "tools": self._search_tools(),
+                    "input": search_query
+                }
+            }, ensure_ascii=False))
+        
+        batch = None
+        if requests:
+            batch_input = await self.client.files.create(
+                file=("search_requests.jsonl", "\n".join(requests).encode("utf-8")),
+                purpose="batch"
+            )
+            batch = await self.client.batches.create(
+                input_file_id=batch_input.id,
+                endpoint="/v1/responses",
+                completion_window="24h"
+            )
+            print(f"Submitted batch {batch.id} with {len(requests)} searches")
+            
+            batch = await self._wait_for_batch(batch, timeout)
+        
+        search_results = []
+        
+        with StepResultWriter(search_dir, keep_raw) as step_writer, ResearchSummaryWriter(plan, run_dir / RESEARCH_SUMMARY_FILENAME) as summary_writer:
+            if batch is not None and batch.status == "completed" and batch.output_file_id:
+                output = await self.client.files.content(batch.output_file_id)
                 
-            summary_path = search_dir / f"step_{i}_summary.txt"
-            with open(summary_path, "w", encoding="utf-8") as f:
-                f.write(f"RESEARCH STEP {i}: {step.instruction}\n\n")
-                f.write(f"SEARCH QUERY: {result.search_query}\n\n")
-                f.write(f"SUMMARY:\n{result.summary}\n\n")
-                f.write("CITATIONS:\n")
-                for citation in result.citations:
-                    f.write(f"- {citation.get('title')}: {citation.get('url')}\n")
-        
-        combined_summary_path = run_dir / "research_summary.txt"
-        with open(combined_summary_path, "w", encoding="utf-8") as f:
-            f.write(f"RESEARCH SUMMARY FOR: {plan.query}\n\n")
-            f.write(f"REASONING: {plan.reasoning}\n\n")
+                for line in output.text.splitlines():
+                    if not line.strip():
+                        continue
+                    
+                    try:
+                        item = json.loads(line)
+                        i = int(item["custom_id"].removeprefix("step_"))
+                        body = (item.get("response") or {}).get("body")
+                        if item.get("error") or not body:
+                            print(f"Batch search for step {i} failed: {item.get('error')}")
+                            continue
+                        
+                        search_response = self._format_response(Response.model_validate(body))
+                        set_cached(self._search_cache_key(search_queries[i], self._search_tools()), search_response, ttl=SEARCH_CACHE_TTL_SECONDS)
+                        result = self._build_search_result(plan.steps[i - 1], i, search_queries[i], search_response)
+                        search_results.append(result)
+                        step_writer.add(result)
+                        summary_writer.add(result)
+                    except Exception as e:
+                        print(f"Error parsing batch output: {e}")
+            elif batch is not None:
+                print(f"Batch {batch.id} did not complete in time (status: {batch.status})")
+                if batch.status not in BATCH_FINAL_STATUSES:
+                    try:
+                        await self.client.batches.cancel(batch.id)
+                    except Exception as e:
+                        print(f"Error cancelling batch {batch.id}: {e}")
+            
+            completed = {result.step_number for result in search_results}
+            missing = [i for i in step_numbers if i not in completed]
+            if missing:
+                print(f"Searching {len(missing)} steps directly")
+                search_results.extend(await self._execute_search_steps(plan, search_queries, missing, step_writer, summary_writer))
             
-            for result in search_results:
-                f.write(f"STEP {result.step_number}: {result.step_instruction}\n\n")
-                f.write(f"SUMMARY:\n{result.summary}\n\n")
-                f.write("---\n\n")
+            search_results = self._add_duplicate_results(plan, duplicates, search_results, step_writer, summary_writer)
         
         return search_results
@@ -1,29 +1,49 @@
-from typing import Optional
+from pathlib import Path
+from typing import Optional, TYPE_CHECKING
+import asyncio
 import typer
 from rich.console import Console
 from rich.panel import Panel
 from rich.table import Table
 from rich.markdown import Markdown
+from rich.style import Style
+from rich.text import Text
+from rich.live import Live
 from rich.progress import Progress, SpinnerColumn, TextColumn
 from rich.prompt import Prompt
 import traceback
 import sys
-import json
+import time
 
-from agents.planner_agent import PlannerAgent, ResearchPlan
-from agents.search_agent import SearchAgent
-from agents.report_agent import ReportAgent
+# The agents pull in the OpenAI SDK, so they are imported where they're used to keep --help fast
+if TYPE_CHECKING:
+    from agents.planner_agent import ResearchPlan
+    from agents.report_agent import ReportAgent
 
 app = typer.Typer()
-console = Console()
+# Output is mostly LLM-written text, where highlighting numbers and URLs only costs regex passes
+console = Console(highlight=False)
 
-def display_plan(plan: ResearchPlan) -> None:
+# Parsed once here instead of as markup on every status print
+ERR = Style(color="red", bold=True)
+WARN = Style(color="yellow", bold=True)
+OK = Style(color="green", bold=True)
+INFO = Style(color="cyan", bold=True)
+
+PAGER_THRESHOLD_CHARS = 64 * 1024
+
+def display_plan(plan: "ResearchPlan") -> None:
     """Display the research plan in a beautiful format"""
     console.print("\n")
+    details = Text.assemble(
+        ("Research Query:", "bold blue"), f"\n{plan.query}\n\n",
+        ("Reasoning:", "bold green"), f"\n{plan.reasoning}"
+    )
+    if plan.run_id:
+        details.append_text(Text.assemble("\n\n", ("Run ID:", "bold yellow"), f" {plan.run_id}"))
+
     console.print(Panel(
-        f"[bold blue]Research Query:[/bold blue]\n{plan.query}\n\n"
-        f"[bold green]Reasoning:[/bold green]\n{plan.reasoning}\n\n"
-        f"[bold yellow]Run ID:[/bold yellow] {plan.run_id}",
+        details,
         title="Research Plan",
         border_style="blue"
     ))
@@ -44,37 +64,66 @@ def display_plan(plan: ResearchPlan) -> None:
     console.print(table)
     console.print("\n")
 
-def display_search_results(search_summary_path):
+def display_markdown(content: str, title: str) -> None:
+    """Display Markdown in a panel, or through the pager without a panel when it is too long to scroll through"""
+    if len(content) > PAGER_THRESHOLD_CHARS:
+        with console.pager(styles=True):
+            console.print(Markdown(content))
+        return
+    
+    console.print(Panel(
+        Markdown(content),
+        title=title,
+        border_style="green"
+    ))
+
+def display_search_results(summary: str) -> None:
     """Display the search results summary"""
     try:
-        with open(search_summary_path, "r", encoding="utf-8") as f:
-            summary = f.read()
-        
-        console.print(Panel(
-            Markdown(summary),
-            title="Research Summary",
-            border_style="green"
-        ))
+        display_markdown(summary, "Research Summary")
     except Exception as e:
-        console.print(f"[bold red]Error displaying search results: {e}[/bold red]")
+        console.print(Text(f"Error displaying search results: {e}", style=ERR))
 
-def display_markdown_file(file_path):
+def display_markdown_file(file_path: Path) -> None:
     """Display the contents of a markdown file"""
     try:
-        with open(file_path, "r", encoding="utf-8") as f:
-            content = f.read()
-        
-        console.print(Panel(
-            Markdown(content),
-            title="Research Report",
-            border_style="green"
-        ))
+        content = file_path.read_text(encoding="utf-8")
+        display_markdown(content, "Research Report")
     except Exception as e:
-        console.print(f"[bold red]Error displaying markdown file: {e}[/bold red]")
+        console.print(Text(f"Error displaying markdown file: {e}", style=ERR))
 
-@app.command()
-def research():
-    """Start a new research session"""
+def create_progress() -> Progress:
+    """Create a spinner for a long-running step, redrawn sparingly and left out entirely when output isn't a terminal"""
+    return Progress(
+        SpinnerColumn(),
+        TextColumn("[progress.description]{task.description}"),
+        console=console,
+        transient=True,
+        refresh_per_second=4,
+        disable=not console.is_terminal,
+    )
+
+async def stream_report(report_agent: "ReportAgent", plan: "ResearchPlan", search_results, run_dir):
+    """Generate the research report while showing the latest part of it as it streams in"""
+    report_parts = []
+    last_refresh = 0.0
+
+    with Live(console=console, transient=True) as live:
+        def show_token(token):
+            nonlocal last_refresh
+            report_parts.append(token)
+
+            # Re-rendering the Markdown on every token gets slow for long reports
+            now = time.monotonic()
+            if now - last_refresh >= 0.25:
+                last_refresh = now
+                visible_lines = "".join(report_parts).splitlines()[-max(console.height - 2, 1):]
+                live.update(Markdown("\n".join(visible_lines)))
+
+        return await report_agent.generate_and_save_report(plan, search_results, run_dir, on_token=show_token)
+
+async def run_research(batch: bool, batch_timeout: Optional[float], keep_raw: bool, sequential: bool, debug: bool):
+    """Run a research session on a single event loop shared by all agents"""
     console.print(Panel.fit(
         "[bold blue]Deep Research Agent[/bold blue]\n"
         "Let me help you conduct thorough research on any topic.",
@@ -84,20 +133,16 @@ def research():
     try:
         query = Prompt.ask("\n[bold green]What would you like to research?[/bold green]")
 
+        from agents.planner_agent import PlannerAgent
+        
         planner = PlannerAgent()
 
-        with Progress(
-            SpinnerColumn(),
-            TextColumn("[progress.description]{task.description}"),
-            transient=True,
-        ) as progress:
+        with create_progress() as progress:
             progress.add_task(description="Creating research plan...", total=None)
-            plan, run_dir = planner.create_initial_plan(query)
+            plan = await planner.create_initial_plan(query)
 
         display_plan(plan)
         
-        console.print(f"\n[bold cyan]Plan saved to:[/bold cyan] {run_dir / 'plan.json'}")
-        
         execute = Prompt.ask(
             "\n[bold blue]Would you like to execute this research plan?[/bold blue]",
             choices=["y", "n"],
@@ -105,67 +150,48 @@ def research():
         )
         
         if execute.lower() == "y":
+            run_dir = planner.persist_plan(plan)
+            console.print(Text.assemble("\n", ("Plan saved to:", INFO), f" {run_dir / 'plan.json'}"))
+            console.print(Text.assemble(("Run ID:", "bold yellow"), f" {plan.run_id}"))
+            
             try:
-                search_agent = SearchAgent()
+                from agents.search_agent import SearchAgent, BATCH_TIMEOUT_SECONDS, MAX_SEARCH_WORKERS
                 
-                search_dir = run_dir / "search_results"
-                search_dir.mkdir(exist_ok=True)
+                search_agent = SearchAgent()
                 
                 total_steps = len(plan.steps)
-                console.print(f"\n[bold cyan]Starting research with {total_steps} steps...[/bold cyan]")
-                
-                search_results = []
+                console.print(Text(f"\nStarting research with {total_steps} steps...", style=INFO))
                 
-                for i, step in enumerate(plan.steps, 1):
-                    try:
-                        console.print(f"\n[bold cyan]Step {i}/{total_steps}:[/bold cyan] {step.instruction[:80]}...")
-                        
-                        with Progress(
-                            SpinnerColumn(),
-                            TextColumn("[progress.description]{task.description}"),
-                            transient=True,
-                        ) as progress:
-                            progress.add_task(description=f"Researching step {i}...", total=None)
-                            result = search_agent.execute_search_step(step, i)
-                            search_results.append(result)
-                        
-                        result_path = search_dir / f"step_{i}_result.json"
-                        with open(result_path, "w", encoding="utf-8") as f:
-                            json.dump(result.model_dump(), f, indent=2, ensure_ascii=False)
-                            
-                        summary_path = search_dir / f"step_{i}_summary.txt"
-                        with open(summary_path, "w", encoding="utf-8") as f:
-                            f.write(f"RESEARCH STEP {i}: {step.instruction}\n\n")
-                            f.write(f"SEARCH QUERY: {result.search_query}\n\n")
-                            f.write(f"SUMMARY:\n{result.summary}\n\n")
-                            f.write("CITATIONS:\n")
-                            for citation in result.citations:
-                                f.write(f"- {citation.get('title', 'No title')}: {citation.get('url', 'No URL')}\n")
+                if batch:
+                    with create_progress() as progress:
+                        progress.add_task(description="Waiting for the batch to complete...", total=None)
+                        search_results = await search_agent.execute_research_plan_batch(
+                            plan,
+                            run_dir,
+                            timeout=batch_timeout if batch_timeout is not None else BATCH_TIMEOUT_SECONDS,
+                            keep_raw=keep_raw
+                        )
+                else:
+                    # --sequential runs the same plan execution, one step at a time for tight rate limits
+                    max_concurrency = 1 if sequential else MAX_SEARCH_WORKERS
+                    description = f"Researching {total_steps} steps one at a time..." if sequential else f"Researching {total_steps} steps concurrently..."
+                    
+                    with create_progress() as progress:
+                        task_id = progress.add_task(description=description, total=total_steps)
                         
-                        console.print(f"[green]✓[/green] Step {i} completed")
+                        def show_result(result):
+                            progress.advance(task_id)
+                            console.print(Text("✓", style=OK), f"Step {result.step_number} completed")
                         
-                    except Exception as e:
-                        console.print(f"[bold red]Error in step {i}:[/bold red] {str(e)}")
-                        traceback.print_exc()
-                        console.print("[yellow]Continuing with next step...[/yellow]")
+                        search_results = await search_agent.execute_research_plan(plan, run_dir, keep_raw=keep_raw, on_result=show_result, max_concurrency=max_concurrency)
                 
                 try:
-                    console.print("\n[bold cyan]Creating research summary...[/bold cyan]")
-                    combined_summary_path = run_dir / "research_summary.txt"
-                    with open(combined_summary_path, "w", encoding="utf-8") as f:
-                        f.write(f"RESEARCH SUMMARY FOR: {plan.query}\n\n")
-                        f.write(f"REASONING: {plan.reasoning}\n\n")
-                        
-                        for result in search_results:
-                            f.write(f"STEP {result.step_number}: {result.step_instruction}\n\n")
-                            f.write(f"SUMMARY:\n{result.summary}\n\n")
-                            f.write("---\n\n")
+                    console.print(Text("\nResearch completed!", style=OK))
+                    console.print(Text.assemble(("Results saved to:", INFO), f" {run_dir}"))
                     
-                    console.print(f"\n[bold green]Research completed![/bold green]")
-                    console.print(f"[bold cyan]Results saved to:[/bold cyan] {run_dir}")
-                    
-                    console.print(f"\n[bold cyan]Research Summary:[/bold cyan]")
-                    display_search_results(combined_summary_path)
+                    console.print(Text("\nResearch Summary:", style=INFO))
+                    # Formatted from the results in memory rather than read back from the file just written
+                    display_search_results(search_agent.format_research_summary(plan, search_results))
                     
                     generate_report = Prompt.ask(
                         "\n[bold blue]Would you like to generate a comprehensive research report?[/bold blue]",
@@ -175,47 +201,60 @@ def research():
                     
                     if generate_report.lower() == "y":
                         try:
-                            console.print("\n[bold cyan]Generating comprehensive research report...[/bold cyan]")
+                            console.print(Text("\nGenerating comprehensive research report...", style=INFO))
+                            
+                            from agents.report_agent import ReportAgent
                             
-                            with Progress(
-                                SpinnerColumn(),
-                                TextColumn("[progress.description]{task.description}"),
-                                transient=True,
-                            ) as progress:
-                                progress.add_task(description="Generating report...", total=None)
-                                report_agent = ReportAgent()
-                                report_path = report_agent.generate_and_save_report(plan, search_results, run_dir)
+                            report_agent = ReportAgent()
+                            report_path = await stream_report(report_agent, plan, search_results, run_dir)
                             
-                            console.print(f"\n[bold green]Research report generated![/bold green]")
-                            console.print(f"[bold cyan]Report saved to:[/bold cyan] {report_path}")
+                            console.print(Text("\nResearch report generated!", style=OK))
+                            console.print(Text.assemble(("Report saved to:", INFO), f" {report_path}"))
                             
-                            console.print(f"\n[bold cyan]Research Report:[/bold cyan]")
+                            console.print(Text("\nResearch Report:", style=INFO))
                             display_markdown_file(report_path)
                         except Exception as e:
-                            console.print(f"[bold red]Error generating research report:[/bold red] {str(e)}")
-                            traceback.print_exc()
+                            console.print(Text("Error generating research report:", style=ERR), e)
+                            if debug:
+                                traceback.print_exc()
                     else:
-                        console.print("\n[bold yellow]Report generation skipped.[/bold yellow]")
+                        console.print(Text("\nReport generation skipped.", style=WARN))
                     
                 except Exception as e:
-                    console.print(f"[bold red]Error creating research summary:[/bold red] {str(e)}")
-                    traceback.print_exc()
+                    console.print(Text("Error creating research summary:", style=ERR), e)
+                    if debug:
+                        traceback.print_exc()
             
             except Exception as e:
-                console.print(f"\n[bold red]Error executing research plan:[/bold red] {str(e)}")
-                traceback.print_exc()
+                console.print(Text("\nError executing research plan:", style=ERR), e)
+                if debug:
+                    traceback.print_exc()
         else:
-            console.print("\n[bold yellow]Research plan execution cancelled.[/bold yellow]")
+            console.print(Text("\nResearch plan execution cancelled.", style=WARN))
     
     except Exception as e:
-        console.print(f"\n[bold red]An error occurred:[/bold red] {str(e)}")
-        traceback.print_exc()
-        console.print("\n[bold red]Research session terminated due to an error.[/bold red]")
+        console.print(Text("\nAn error occurred:", style=ERR), e)
+        if debug:
+            traceback.print_exc()
+        console.print(Text("\nResearch session terminated due to an error.", style=ERR))
+
+@app.command()
+def research(
+    batch: bool = typer.Option(False, "--batch", help="Run the web searches through the OpenAI Batch API at a lower cost, trading latency for price"),
+    batch_timeout: Optional[float] = typer.Option(None, "--batch-timeout", help="Seconds to wait for the batch before searching the remaining steps directly", show_default="30 minutes"),
+    keep_raw: bool = typer.Option(False, "--keep-raw", help="Also save the raw API response of each step, gzip-compressed"),
+    sequential: bool = typer.Option(False, "--sequential", help="Research the steps one at a time instead of concurrently, for API keys with tight rate limits"),
+    debug: bool = typer.Option(False, "--debug", help="Print the full traceback of errors"),
+):
+    """Start a new research session"""
+    asyncio.run(run_research(batch, batch_timeout, keep_raw, sequential, debug))
 
 def main():
     try:
         app()
     except Exception as e:
-        console.print(f"\n[bold red]Critical error:[/bold red] {str(e)}")
+        console.print(Text("\nCritical error:", style=ERR), e)
+        # --debug isn't parsed yet when the CLI itself fails, and errors in a session never get here,
+        # so anything caught here is a crash worth the full traceback
         traceback.print_exc()
         sys.exit(1)
@@ -1,30 +1,28 @@
-from datetime import datetime
+from datetime import date
+import functools
 import json
-import random
-import string
+import secrets
 from pathlib import Path
 from typing import Any
 
+@functools.lru_cache(maxsize=1)
 def get_data_dir() -> Path:
-    """Get the base data directory path"""
+    """Get the base data directory path, creating it on the first call only"""
     base_dir = Path("data")
     base_dir.mkdir(exist_ok=True)
     return base_dir
 
 def generate_run_id(length: int = 8) -> str:
-    """Generate a simple random run ID"""
-    return ''.join(random.choices(string.ascii_lowercase + string.digits, k=length))
+    """Generate a random run ID of lowercase hex digits from the OS random source"""
+    return secrets.token_hex((length + 1) // 2)[:length]
 
 def create_run_directory() -> tuple[Path, str]:
     """Create a new run directory with today's date and a unique run ID"""
-    date_str = datetime.now().strftime("%Y-%m-%d")
+    date_str = date.today().isoformat()
     run_id = generate_run_id()
     
-    date_dir = get_data_dir() / date_str
-    date_dir.mkdir(exist_ok=True)
-    
-    run_dir = date_dir / run_id
-    run_dir.mkdir(exist_ok=True)
+    run_dir = get_data_dir() / date_str / run_id
+    run_dir.mkdir(parents=True, exist_ok=True)
     
     return run_dir, run_id
 
@@ -32,12 +30,12 @@ def save_plan_to_json(plan: Any, run_dir: Path) -> Path:
     """Save a plan to plan.json in the specified run directory"""
     plan_path = run_dir / "plan.json"
     
-    if hasattr(plan, "model_dump"):
-        plan_dict = plan.model_dump()
+    # Pydantic models are serialized by pydantic-core without building an intermediate dict
+    if hasattr(plan, "model_dump_json"):
+        plan_json = plan.model_dump_json(indent=2)
     else:
-        plan_dict = plan
-        
-    with open(plan_path, "w", encoding="utf-8") as f:
-        json.dump(plan_dict, f, indent=2, ensure_ascii=False)
-        
+        plan_json = json.dumps(plan, indent=2, ensure_ascii=False)
+    
+    plan_path.write_text(plan_json, encoding="utf-8")
+    
     return plan_path
\ No newline at end of file
@@ -0,0 +1,93 @@
+import functools
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from contextlib import closing
+from typing import Any, Callable, Dict, Optional, Type
+from pydantic import BaseModel
+
+from utils.file_utils import get_data_dir
+
+CACHE_FILENAME = "llm_cache.sqlite3"
+
+def is_cache_enabled() -> bool:
+    """Check whether LLM response caching is enabled through the CACHE_ENABLED environment variable"""
+    return os.getenv("CACHE_ENABLED", "true").strip().lower() not in ("0", "false", "no", "off")
+
+def _describe(value: Any) -> str:
+    """Describe values json can't serialize, e.g. a response_format model class by its schema name"""
+    return getattr(value, "__name__", str(value))
+
+def make_cache_key(request: Dict[str, Any]) -> str:
+    """Build a stable cache key from the parameters of an OpenAI request"""
+    payload = json.dumps(request, sort_keys=True, ensure_ascii=False, default=_describe)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def _connect() -> sqlite3.Connection:
+    """Open the cache database, creating the table on first use"""
+    conn = sqlite3.connect(get_data_dir() / CACHE_FILENAME, timeout=30)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)"
+    )
+    return conn
+
+def get_cached(request: Dict[str, Any]) -> Optional[Any]:
+    """Return the cached value for a request, or None on a miss or expired entry"""
+    if not is_cache_enabled():
+        return None
+
+    with closing(_connect()) as conn:
+        row = conn.execute(
+            "SELECT value, expires_at FROM llm_cache WHERE key = ?",
+            (make_cache_key(request),)
+        ).fetchone()
+
+    if row is None:
+        return None
+
+    value, expires_at = row
+    if expires_at is not None and expires_at < time.time():
+        return None
+
+    return json.loads(value)
+
+def _serialize(value: Any) -> str:
+    """Serialize a cache value, letting pydantic-core encode models without building an intermediate dict"""
+    if isinstance(value, BaseModel):
+        return value.model_dump_json()
+    return json.dumps(value, ensure_ascii=False)
+
+def set_cached(request: Dict[str, Any], value: Any, ttl: Optional[float] = None) -> None:
+    """Store a pydantic model or JSON-serializable value for a request, optionally expiring after ttl seconds"""
+    if not is_cache_enabled():
+        return
+
+    expires_at = time.time() + ttl if ttl is not None else None
+
+    with closing(_connect()) as conn, conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO llm_cache (key, value, expires_at) VALUES (?, ?, ?)",
+            (make_cache_key(request), _serialize(value), expires_at)
+        )
+
+def cached_llm_call(response_model: Type[BaseModel], ttl: Optional[float] = None) -> Callable:
+    """Memoize an async agent method that sends an OpenAI request given as keyword arguments.
+
+    The full response is stored as JSON and validated back into response_model on a hit.
+    """
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        async def wrapper(self, **request: Any) -> BaseModel:
+            cached = get_cached(request)
+            if cached is not None:
+                return response_model.model_validate(cached)
+
+            response = await func(self, **request)
+            set_cached(request, response, ttl)
+            return response
+
+        return wrapper
+
+    return decorator
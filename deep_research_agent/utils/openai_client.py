@@ -0,0 +1,27 @@
+import functools
+import os
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+from dotenv import load_dotenv
+
+MAX_API_RETRIES = 5
+MAX_CONNECTIONS = 32
+MAX_KEEPALIVE_CONNECTIONS = 16
+
+@functools.lru_cache(maxsize=1)
+def get_openai_client() -> AsyncOpenAI:
+    """Get the OpenAI client shared by all agents, so they reuse one connection pool"""
+    load_dotenv()
+    
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise ValueError("OPENAI_API_KEY environment variable is required")
+    
+    # Research steps run concurrently, so let the client back off and retry on rate limits
+    return AsyncOpenAI(
+        api_key=api_key,
+        max_retries=MAX_API_RETRIES,
+        http_client=DefaultAsyncHttpxClient(
+            limits=httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS)
+        )
+    )
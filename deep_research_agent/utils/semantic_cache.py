@@ -0,0 +1,105 @@
+import asyncio
+import json
+import math
+import threading
+from array import array
+from pathlib import Path
+from typing import List, Optional, Tuple
+from openai import AsyncOpenAI
+from openai.types import CreateEmbeddingResponse
+
+from utils.file_utils import get_data_dir
+from utils.llm_cache import cached_llm_call, is_cache_enabled
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+SEMANTIC_CACHE_FILENAME = "semantic_cache.jsonl"
+
+class SemanticCache:
+    """Cache that returns a stored value for texts whose embeddings are nearly identical"""
+
+    def __init__(self, client: AsyncOpenAI, threshold: float = 0.92, path: Optional[Path] = None):
+        self.client = client
+        self.threshold = threshold
+        self.path = path or get_data_dir() / SEMANTIC_CACHE_FILENAME
+        self._lock = threading.Lock()
+        self._embeddings: List[array] = []
+        self._values: List[str] = []
+        self._load()
+
+    def _load(self) -> None:
+        """Load previously cached entries from disk, once per cache instance"""
+        if not self.path.exists():
+            return
+
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    entry = json.loads(line)
+                    self._embeddings.append(array("d", entry["embedding"]))
+                    self._values.append(entry["value"])
+        except Exception as e:
+            print(f"Error loading semantic cache: {e}")
+
+    def _append(self, embeddings: List[array], values: List[str]) -> None:
+        """Add entries in memory and append them to the cache file, leaving the existing entries untouched"""
+        with self._lock:
+            self._embeddings.extend(embeddings)
+            self._values.extend(values)
+
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.writelines(
+                    json.dumps({"embedding": embedding.tolist(), "value": value}, ensure_ascii=False) + "\n"
+                    for embedding, value in zip(embeddings, values)
+                )
+
+    def _best_match(self, embedding: array) -> Tuple[float, Optional[str]]:
+        """Find the cached value whose embedding is most similar to the given one"""
+        with self._lock:
+            best_score, best_value = -1.0, None
+            for cached_embedding, value in zip(self._embeddings, self._values):
+                score = math.sumprod(embedding, cached_embedding)
+                if score > best_score:
+                    best_score, best_value = score, value
+
+        return best_score, best_value
+
+    @cached_llm_call(CreateEmbeddingResponse)
+    async def _create_embedding(self, **request) -> CreateEmbeddingResponse:
+        """Request an embedding, served from the on-disk cache when possible"""
+        return await self.client.embeddings.create(**request)
+
+    async def embed(self, texts: List[str]) -> List[array]:
+        """Embed several texts with one request, L2-normalized when computed so a dot product gives the cosine similarity"""
+        response = await self._create_embedding(model=EMBEDDING_MODEL, input=texts)
+
+        embeddings = []
+        for item in sorted(response.data, key=lambda item: item.index):
+            norm = math.sqrt(math.sumprod(item.embedding, item.embedding)) or 1.0
+            embeddings.append(array("d", (x / norm for x in item.embedding)))
+        return embeddings
+
+    async def lookup(self, embeddings: List[array]) -> List[Optional[str]]:
+        """Return the value cached for the most similar text of each embedding, or None where none meets the threshold"""
+        matches = await asyncio.to_thread(lambda: [self._best_match(embedding) for embedding in embeddings])
+        return [value if score >= self.threshold else None for score, value in matches]
+
+    async def store(self, embeddings: List[array], values: List[str]) -> None:
+        """Cache a value for each embedding"""
+        await asyncio.to_thread(self._append, embeddings, values)
+
+    async def get(self, text: str) -> Optional[str]:
+        """Return the value cached for the most similar text if it meets the threshold"""
+        if not is_cache_enabled():
+            return None
+
+        (value,) = await self.lookup(await self.embed([text]))
+        return value
+
+    async def add(self, text: str, value: str) -> None:
+        """Cache a value for a text"""
+        if not is_cache_enabled():
+            return
+
+        await self.store(await self.embed([text]), [value])
@@ -0,0 +1,21 @@
+import pytest
+
+from utils.file_utils import get_data_dir
+from utils.openai_client import get_openai_client
+
+@pytest.fixture(autouse=True)
+def data_dir(tmp_path, monkeypatch):
+    """Run every test against an empty data directory with caching enabled"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("CACHE_ENABLED", "true")
+    get_data_dir.cache_clear()
+    yield get_data_dir()
+    get_data_dir.cache_clear()
+
+@pytest.fixture
+def openai_api_key(monkeypatch):
+    """Let agents build the shared OpenAI client without a real key"""
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    get_openai_client.cache_clear()
+    yield
+    get_openai_client.cache_clear()
@@ -0,0 +1,59 @@
+import asyncio
+
+from pydantic import BaseModel
+
+from utils import llm_cache
+from utils.llm_cache import cached_llm_call, get_cached, make_cache_key, set_cached
+
+class Answer(BaseModel):
+    text: str
+
+def test_cache_key_ignores_parameter_order():
+    assert make_cache_key({"model": "m", "input": "q"}) == make_cache_key({"input": "q", "model": "m"})
+    assert make_cache_key({"model": "m", "input": "q"}) != make_cache_key({"model": "m", "input": "other"})
+
+def test_cache_key_describes_response_format_by_name():
+    assert make_cache_key({"response_format": Answer}) == make_cache_key({"response_format": Answer})
+
+def test_round_trip():
+    request = {"model": "m", "input": "q"}
+    assert get_cached(request) is None
+
+    set_cached(request, {"answer": [1, 2]})
+    assert get_cached(request) == {"answer": [1, 2]}
+
+def test_round_trip_of_a_model():
+    set_cached({"input": "q"}, Answer(text="a"))
+    assert Answer.model_validate(get_cached({"input": "q"})) == Answer(text="a")
+
+def test_expired_entry_is_a_miss(monkeypatch):
+    now = 1000.0
+    monkeypatch.setattr(llm_cache.time, "time", lambda: now)
+    set_cached({"input": "q"}, "value", ttl=60)
+
+    now = 1059.0
+    assert get_cached({"input": "q"}) == "value"
+
+    now = 1061.0
+    assert get_cached({"input": "q"}) is None
+
+def test_disabled_cache_stores_nothing(monkeypatch):
+    monkeypatch.setenv("CACHE_ENABLED", "false")
+    set_cached({"input": "q"}, "value")
+    monkeypatch.setenv("CACHE_ENABLED", "true")
+
+    assert get_cached({"input": "q"}) is None
+
+def test_cached_llm_call_serves_repeated_requests_from_cache():
+    calls = []
+
+    class Agent:
+        @cached_llm_call(Answer)
+        async def ask(self, **request):
+            calls.append(request)
+            return Answer(text=request["input"].upper())
+
+    agent = Agent()
+    assert asyncio.run(agent.ask(input="q")) == Answer(text="Q")
+    assert asyncio.run(agent.ask(input="q")) == Answer(text="Q")
+    assert len(calls) == 1
@@ -0,0 +1,93 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from openai import LengthFinishReasonError
+from openai.types.chat import ChatCompletion
+
+from agents.planner_agent import ResearchPlan, ResearchStep
+from agents.report_agent import REPORT_INCOMPLETE_NOTE, ReportAgent, ResearchReport
+from agents.search_agent import SearchResult
+
+REPORT = ResearchReport(
+    title="Solar Power",
+    executive_summary="Summary",
+    introduction="Introduction",
+    methodology="Methodology",
+    findings=[{"title": "Cost", "details": "Falling"}],
+    conclusions="Conclusions",
+    references=[{"title": "Source", "url": "https://example.com"}],
+)
+
+class FakeStream:
+    """Streams the given partial reports, then completes with REPORT or hits the length limit"""
+
+    def __init__(self, partials, truncated=False):
+        self.partials = partials
+        self.truncated = truncated
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+    async def __aiter__(self):
+        for parsed in self.partials:
+            yield SimpleNamespace(type="content.delta", parsed=parsed)
+        if self.truncated:
+            raise LengthFinishReasonError(completion=ChatCompletion.model_validate({
+                "id": "completion",
+                "object": "chat.completion",
+                "created": 0,
+                "model": "gpt-4o-mini",
+                "choices": [{"index": 0, "finish_reason": "length", "message": {"role": "assistant", "content": "{"}}],
+            }))
+
+    async def get_final_completion(self):
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(parsed=REPORT, refusal=None))])
+
+def use_stream(agent, partials, truncated=False):
+    completions = SimpleNamespace(stream=lambda **request: FakeStream(partials, truncated))
+    agent.client = SimpleNamespace(beta=SimpleNamespace(chat=SimpleNamespace(completions=completions)))
+
+@pytest.fixture
+def agent(openai_api_key):
+    return ReportAgent()
+
+@pytest.fixture
+def research():
+    plan = ResearchPlan(query="Solar power", reasoning="Because", steps=[ResearchStep(instruction="Costs", expected_outcome="Prices")])
+    results = [SearchResult(step_number=1, step_instruction="Costs", search_query="solar costs", summary="Falling")]
+    return plan, results
+
+def test_streamed_sections_add_up_to_the_report(agent, research, tmp_path):
+    data = REPORT.model_dump()
+    use_stream(agent, [dict(list(data.items())[:n]) for n in range(1, len(data) + 1)])
+    tokens = []
+
+    report_path = asyncio.run(agent.generate_and_save_report(*research, tmp_path, on_token=tokens.append))
+
+    assert len(tokens) > 1
+    assert "".join(tokens) == agent._render_markdown(REPORT)
+    assert report_path.read_text(encoding="utf-8") == agent._render_markdown(REPORT)
+
+def test_saved_report_is_the_final_one_when_the_stream_differs(agent, research, tmp_path):
+    use_stream(agent, [{"title": "Draft title", "executive_summary": ""}])
+
+    report_path = asyncio.run(agent.generate_and_save_report(*research, tmp_path))
+
+    assert report_path.read_text(encoding="utf-8") == agent._render_markdown(REPORT)
+
+def test_report_cut_off_at_the_length_limit_keeps_the_completed_sections(agent, research, tmp_path):
+    data = REPORT.model_dump()
+    use_stream(agent, [dict(list(data.items())[:n]) for n in range(1, 4)], truncated=True)
+    tokens = []
+
+    report_path = asyncio.run(agent.generate_and_save_report(*research, tmp_path, on_token=tokens.append))
+
+    report = report_path.read_text(encoding="utf-8")
+    assert report == "".join(tokens)
+    assert report.startswith("# Solar Power\n\n## Executive Summary\n\nSummary\n\n")
+    assert report.endswith(REPORT_INCOMPLETE_NOTE)
+    assert "## Introduction" not in report
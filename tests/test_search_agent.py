@@ -0,0 +1,333 @@
+import asyncio
+import json
+import logging
+from types import SimpleNamespace
+
+import pytest
+from openai.types import Batch, CreateEmbeddingResponse, FileObject
+from openai.types.chat import ChatCompletion
+from openai.types.responses import Response
+
+from agents import search_agent
+from agents.planner_agent import ResearchPlan, ResearchStep
+from agents.search_agent import ResearchSummaryWriter, SearchAgent, SearchResult
+
+def make_step(instruction):
+    return ResearchStep(instruction=instruction, expected_outcome=f"Findings about {instruction}")
+
+def make_result(step_number, instruction=None):
+    return SearchResult(
+        step_number=step_number,
+        step_instruction=instruction or f"Step {step_number}",
+        search_query=f"query {step_number}",
+        summary=f"Summary {step_number}",
+    )
+
+def make_completion(content):
+    return ChatCompletion.model_validate({
+        "id": "completion",
+        "object": "chat.completion",
+        "created": 0,
+        "model": "gpt-4o-mini",
+        "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+    })
+
+class FakeClient:
+    """Answers the query generation requests of a SearchAgent and records them"""
+
+    def __init__(self, queries):
+        self.queries = queries
+        self.requests = []
+        self.embeddings = SimpleNamespace(create=self._embed)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+        self.beta = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(parse=self._parse)))
+        self.responses = SimpleNamespace(create=self._search)
+        self.active_searches = 0
+        self.max_active_searches = 0
+        self.failing_instructions = set()
+
+    async def _embed(self, model, input):
+        self.requests.append("embed")
+        return CreateEmbeddingResponse.model_validate({
+            "object": "list",
+            "model": model,
+            "data": [{"object": "embedding", "index": i, "embedding": [float(i == n) for n in range(len(input))]} for i in range(len(input))],
+            "usage": {"prompt_tokens": 0, "total_tokens": 0},
+        })
+
+    async def _parse(self, **request):
+        self.requests.append("parse")
+        if isinstance(self.queries, Exception):
+            raise self.queries
+        # None stands for a refusal, which comes without content
+        return make_completion(None if self.queries is None else json.dumps({"queries": self.queries}))
+
+    async def _create(self, **request):
+        self.requests.append("create")
+        instruction = request["messages"][-1]["content"].splitlines()[0]
+        if instruction in self.failing_instructions:
+            raise RuntimeError("rate limited")
+        return make_completion(f"single {instruction}")
+
+    async def _search(self, model, tools, input):
+        self.active_searches += 1
+        self.max_active_searches = max(self.max_active_searches, self.active_searches)
+        await asyncio.sleep(0.01)
+        self.active_searches -= 1
+        return SimpleNamespace(model=model, created_at=0, output=[{"type": "message", "content": [{"type": "output_text", "text": f"Found {input}", "annotations": []}]}])
+
+class FakeBatchClient(FakeClient):
+    """Runs searches through a fake Batch API that completes unless told to stay in progress"""
+
+    def __init__(self, queries, completes=True, failing_steps=()):
+        super().__init__(queries)
+        self.completes = completes
+        self.failing_steps = set(failing_steps)
+        self.batch_input = None
+        self.cancelled = []
+        self.files = SimpleNamespace(create=self._create_file, content=self._file_content)
+        self.batches = SimpleNamespace(create=self._create_batch, retrieve=self._retrieve_batch, cancel=self._cancel_batch)
+        self.responses = SimpleNamespace(create=self._direct_search)
+        self.direct_searches = []
+
+    def _batch(self, status, output_file_id=None):
+        return Batch.model_validate({
+            "id": "batch_1",
+            "object": "batch",
+            "endpoint": "/v1/responses",
+            "input_file_id": "file_in",
+            "completion_window": "24h",
+            "status": status,
+            "created_at": 0,
+            "output_file_id": output_file_id,
+        })
+
+    async def _create_file(self, file, purpose):
+        self.batch_input = file[1].decode("utf-8")
+        return FileObject.model_validate({"id": "file_in", "object": "file", "bytes": len(file[1]), "created_at": 0, "filename": file[0], "purpose": purpose, "status": "processed"})
+
+    async def _create_batch(self, **request):
+        return self._batch("validating")
+
+    async def _retrieve_batch(self, batch_id):
+        return self._batch("completed", "file_out") if self.completes else self._batch("in_progress")
+
+    async def _cancel_batch(self, batch_id):
+        self.cancelled.append(batch_id)
+
+    async def _file_content(self, file_id):
+        lines = []
+        for line in self.batch_input.splitlines():
+            request = json.loads(line)
+            custom_id = request["custom_id"]
+            if custom_id in self.failing_steps:
+                lines.append(json.dumps({"custom_id": custom_id, "response": None, "error": {"code": "server_error"}}))
+                continue
+
+            body = {
+                "id": "response",
+                "object": "response",
+                "created_at": 0,
+                "model": "gpt-4o-mini",
+                "output": [{"type": "message", "id": "message", "role": "assistant", "status": "completed", "content": [{"type": "output_text", "text": f"Batch found {request['body']['input']}", "annotations": []}]}],
+                "parallel_tool_calls": True,
+                "tool_choice": "auto",
+                "tools": [],
+            }
+            lines.append(json.dumps({"custom_id": custom_id, "response": {"status_code": 200, "body": Response.model_validate(body).model_dump(mode="json")}, "error": None}))
+        # Lines that can't be parsed are skipped
+        lines.append("not json")
+        return SimpleNamespace(text="\n".join(lines))
+
+    async def _direct_search(self, model, tools, input):
+        self.direct_searches.append(input)
+        return await self._search(model, tools, input)
+
+def use_client(agent, client):
+    agent.client = client
+    agent.query_cache.client = client
+
+@pytest.fixture
+def plan():
+    return ResearchPlan(query="Topic", reasoning="Because", steps=[make_step(f"Step {i}") for i in range(1, 4)])
+
+@pytest.fixture
+def agent(openai_api_key):
+    return SearchAgent()
+
+def test_summary_writer_keeps_step_order(plan, tmp_path):
+    path = tmp_path / "summary.txt"
+
+    with ResearchSummaryWriter(plan, path) as writer:
+        writer.add(make_result(2))
+        writer.add(make_result(3))
+        writer._file.flush()
+        # Nothing can be written before step 1 arrives
+        assert "STEP" not in path.read_text(encoding="utf-8")
+        writer.add(make_result(1))
+
+    text = path.read_text(encoding="utf-8")
+    assert text.startswith(ResearchSummaryWriter.format_header(plan))
+    assert text.index("STEP 1:") < text.index("STEP 2:") < text.index("STEP 3:")
+
+def test_summary_writer_writes_held_back_results_on_close(plan, tmp_path):
+    path = tmp_path / "summary.txt"
+
+    with ResearchSummaryWriter(plan, path) as writer:
+        writer.add(make_result(3))
+        writer.add(make_result(2))
+
+    text = path.read_text(encoding="utf-8")
+    assert "STEP 1:" not in text
+    assert text.index("STEP 2:") < text.index("STEP 3:")
+
+def test_summary_writer_matches_formatted_summary(plan, tmp_path, agent):
+    path = tmp_path / "summary.txt"
+    results = [make_result(3), make_result(1), make_result(2)]
+
+    with ResearchSummaryWriter(plan, path) as writer:
+        for result in results:
+            writer.add(result)
+
+    assert path.read_text(encoding="utf-8") == agent.format_research_summary(plan, results)
+
+def test_find_duplicate_steps_ignores_case_and_surrounding_whitespace(agent):
+    steps = [make_step("Solar power"), make_step("Wind power"), make_step("  solar POWER "), make_step("Wind power")]
+
+    assert agent.find_duplicate_steps(steps) == {3: 1, 4: 2}
+
+def test_copy_step_result_takes_over_the_duplicate_step(agent):
+    original = make_result(1, "Solar power")
+    copy = agent.copy_step_result(original, make_step("solar power"), 3)
+
+    assert (copy.step_number, copy.step_instruction) == (3, "solar power")
+    assert (copy.search_query, copy.summary) == (original.search_query, original.summary)
+    assert original.step_number == 1
+
+def test_search_queries_embed_all_steps_with_one_request(plan, agent):
+    client = FakeClient(["query 1", "query 2", "query 3"])
+    use_client(agent, client)
+
+    assert asyncio.run(agent.generate_search_queries(plan.steps)) == ["query 1", "query 2", "query 3"]
+    assert client.requests == ["embed", "parse"]
+
+def test_mismatched_search_query_count_falls_back_to_one_request_per_step(plan, agent, caplog):
+    client = FakeClient(["query 1"])
+    use_client(agent, client)
+
+    with caplog.at_level(logging.WARNING):
+        search_queries = asyncio.run(agent.generate_search_queries(plan.steps))
+
+    assert search_queries == [f"single Research instruction: Step {i}" for i in range(1, 4)]
+    assert client.requests == ["embed", "parse", "create", "create", "create"]
+    assert "Expected 3 search queries but got 1" in caplog.text
+
+@pytest.mark.parametrize("queries", [RuntimeError("rate limited"), None], ids=["error", "refusal"])
+def test_failed_search_query_request_falls_back_to_one_request_per_step(plan, agent, caplog, queries):
+    client = FakeClient(queries)
+    use_client(agent, client)
+
+    with caplog.at_level(logging.WARNING):
+        search_queries = asyncio.run(agent.generate_search_queries(plan.steps))
+
+    assert search_queries == [f"single Research instruction: Step {i}" for i in range(1, 4)]
+    assert client.requests == ["embed", "parse", "create", "create", "create"]
+    assert "falling back to one request per step" in caplog.text
+
+def test_no_steps_need_no_requests(agent):
+    client = FakeClient([])
+    use_client(agent, client)
+
+    assert asyncio.run(agent.generate_search_queries([])) == []
+    assert client.requests == []
+
+def test_failed_search_is_logged_and_returned_as_an_error(agent, caplog):
+    async def fail(**request):
+        raise RuntimeError("connection reset")
+    agent.client = SimpleNamespace(responses=SimpleNamespace(create=fail))
+
+    with caplog.at_level(logging.WARNING):
+        search_response = asyncio.run(agent.search_web("solar costs"))
+
+    assert search_response == {"error": "connection reset"}
+    assert "Error searching web for 'solar costs'" in caplog.text
+    assert caplog.records[-1].exc_info is not None
+
+@pytest.mark.parametrize("max_concurrency, expected_max_active", [(1, 1), (8, 3)])
+def test_research_plan_respects_max_concurrency(plan, agent, tmp_path, max_concurrency, expected_max_active):
+    client = FakeClient(["query 1", "query 2", "query 3"])
+    use_client(agent, client)
+    completed = []
+
+    results = asyncio.run(agent.execute_research_plan(plan, tmp_path, on_result=lambda result: completed.append(result.step_number), max_concurrency=max_concurrency))
+
+    assert client.max_active_searches == expected_max_active
+    assert [result.summary for result in results] == ["Found query 1", "Found query 2", "Found query 3"]
+    assert sorted(completed) == [1, 2, 3]
+
+def test_failed_step_is_skipped_and_the_others_are_saved(plan, agent, tmp_path, caplog):
+    client = FakeClient(RuntimeError("rate limited"))
+    client.failing_instructions = {"Research instruction: Step 1"}
+    use_client(agent, client)
+    completed = []
+
+    with caplog.at_level(logging.WARNING):
+        results = asyncio.run(agent.execute_research_plan(plan, tmp_path, on_result=lambda result: completed.append(result.step_number)))
+
+    assert [result.step_number for result in results] == [2, 3]
+    assert sorted(completed) == [2, 3]
+    assert "Error in research step 1" in caplog.text
+
+    summary = (tmp_path / "research_summary.txt").read_text(encoding="utf-8")
+    assert "STEP 1:" not in summary
+    assert summary.index("STEP 2:") < summary.index("STEP 3:")
+    assert len((tmp_path / "search_results" / "results.jsonl").read_text(encoding="utf-8").splitlines()) == 2
+
+def test_unreadable_search_response_is_logged(agent, caplog):
+    with caplog.at_level(logging.WARNING):
+        citations = agent.extract_citations({"output_items": [{"type": "message", "content": None}]})
+        summary = agent.extract_summary({"output_items": [{"type": "message", "content": None}]})
+
+    assert citations == []
+    assert summary.startswith("Error extracting summary")
+    assert "Error extracting citations" in caplog.text
+    assert "Error extracting summary" in caplog.text
+
+@pytest.fixture
+def fast_batch_polling(monkeypatch):
+    monkeypatch.setattr(search_agent, "BATCH_POLL_INITIAL_DELAY", 0.01)
+
+def test_batch_results_are_used_and_failed_lines_searched_directly(plan, agent, tmp_path, fast_batch_polling):
+    client = FakeBatchClient(["query 1", "query 2", "query 3"], failing_steps={"step_2"})
+    use_client(agent, client)
+
+    results = asyncio.run(agent.execute_research_plan_batch(plan, tmp_path, timeout=1))
+
+    assert [result.summary for result in results] == ["Batch found query 1", "Found query 2", "Batch found query 3"]
+    assert client.direct_searches == ["query 2"]
+    assert client.cancelled == []
+
+    summary = (tmp_path / "research_summary.txt").read_text(encoding="utf-8")
+    assert summary.index("STEP 1:") < summary.index("STEP 2:") < summary.index("STEP 3:")
+
+def test_batch_timeout_cancels_the_batch_and_searches_directly(plan, agent, tmp_path, fast_batch_polling):
+    client = FakeBatchClient(["query 1", "query 2", "query 3"], completes=False)
+    use_client(agent, client)
+
+    results = asyncio.run(agent.execute_research_plan_batch(plan, tmp_path, timeout=0.05))
+
+    assert [result.summary for result in results] == ["Found query 1", "Found query 2", "Found query 3"]
+    assert sorted(client.direct_searches) == ["query 1", "query 2", "query 3"]
+    assert client.cancelled == ["batch_1"]
+
+def test_batch_only_submits_steps_once(agent, tmp_path, fast_batch_polling):
+    steps = [make_step("Solar power"), make_step("solar power"), make_step("Wind power")]
+    plan = ResearchPlan(query="Topic", reasoning="Because", steps=steps)
+    client = FakeBatchClient(["query 1", "query 3"])
+    use_client(agent, client)
+
+    results = asyncio.run(agent.execute_research_plan_batch(plan, tmp_path, timeout=1))
+
+    assert [json.loads(line)["custom_id"] for line in client.batch_input.splitlines()] == ["step_1", "step_3"]
+    assert [(result.step_number, result.summary) for result in results] == [(1, "Batch found query 1"), (2, "Batch found query 1"), (3, "Batch found query 3")]
+    assert client.direct_searches == []
@@ -0,0 +1,76 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from openai.types import CreateEmbeddingResponse
+
+from utils.semantic_cache import SemanticCache
+
+VECTORS = {
+    "solar power": [3.0, 4.0, 0.0],
+    "solar energy": [3.0, 4.1, 0.1],
+    "deep sea fish": [0.0, 0.0, 1.0],
+}
+
+class FakeEmbeddings:
+    def __init__(self):
+        self.requests = []
+
+    async def create(self, model, input):
+        self.requests.append(input)
+        return CreateEmbeddingResponse.model_validate({
+            "object": "list",
+            "model": model,
+            "data": [{"object": "embedding", "index": i, "embedding": VECTORS[text]} for i, text in enumerate(input)],
+            "usage": {"prompt_tokens": 0, "total_tokens": 0},
+        })
+
+@pytest.fixture
+def client():
+    return SimpleNamespace(embeddings=FakeEmbeddings())
+
+def test_similar_text_meets_threshold(client):
+    cache = SemanticCache(client)
+    asyncio.run(cache.add("solar power", "solar query"))
+
+    assert asyncio.run(cache.get("solar energy")) == "solar query"
+    assert asyncio.run(cache.get("deep sea fish")) is None
+
+def test_threshold_is_configurable(client):
+    cache = SemanticCache(client, threshold=0.9999)
+    asyncio.run(cache.add("solar power", "solar query"))
+
+    assert asyncio.run(cache.get("solar power")) == "solar query"
+    assert asyncio.run(cache.get("solar energy")) is None
+
+def test_entries_survive_a_restart(client):
+    cache = SemanticCache(client)
+    asyncio.run(cache.add("solar power", "solar query"))
+    asyncio.run(cache.add("deep sea fish", "fish query"))
+
+    reloaded = SemanticCache(client)
+    assert asyncio.run(reloaded.get("solar energy")) == "solar query"
+    assert asyncio.run(reloaded.get("deep sea fish")) == "fish query"
+
+def test_entries_are_appended_to_the_file(client):
+    cache = SemanticCache(client)
+    asyncio.run(cache.add("solar power", "solar query"))
+    asyncio.run(cache.add("deep sea fish", "fish query"))
+
+    assert len(cache.path.read_text(encoding="utf-8").splitlines()) == 2
+
+def test_embed_sends_one_request_for_several_texts(client):
+    cache = SemanticCache(client)
+    embeddings = asyncio.run(cache.embed(["solar power", "deep sea fish"]))
+    asyncio.run(cache.store(embeddings, ["solar query", "fish query"]))
+
+    assert client.embeddings.requests == [["solar power", "deep sea fish"]]
+    assert asyncio.run(cache.lookup(embeddings)) == ["solar query", "fish query"]
+
+def test_disabled_cache_skips_the_embedding_request(client, monkeypatch):
+    monkeypatch.setenv("CACHE_ENABLED", "false")
+    cache = SemanticCache(client)
+    asyncio.run(cache.add("solar power", "solar query"))
+
+    assert asyncio.run(cache.get("solar power")) is None
+    assert client.embeddings.requests == []